@@ -1,81 +1,184 @@
-import io
 import os
 import gzip
+import asyncio
 import json
+import zlib
 import logging
 import atexit
+import operator
+import time
+import functools
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
 
 import azure.functions as func
-from azure.identity import DefaultAzureCredential
-from azure.eventhub import EventHubProducerClient, EventData
+from azure.identity.aio import DefaultAzureCredential
+from azure.eventhub import EventData, EventDataBatch
+from azure.eventhub.aio import EventHubProducerClient
+
+# orjson is considerably faster than the stdlib on dict-heavy payloads and works on
+# bytes directly; fall back to json if it isn't available in the deployment.
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# simdjson parses lazily: only the fields _flatten_records actually touches are
+# turned into Python objects, which matters for multi-MB blobs.
+try:
+    import simdjson
+except ImportError:  # pragma: no cover
+    simdjson = None
 
 # Environment variables (set in Function App configuration)
 EVENTHUB_FQDN = os.getenv("EVENTHUB_FQDN")         # e.g., "mynamespace.servicebus.windows.net"
 EVENTHUB_NAME = os.getenv("EVENTHUB_NAME")         # e.g., "nw-flowlogs"
 MAX_EVENTS_PER_BATCH = int(os.getenv("MAX_EVENTS_PER_BATCH", "500"))
+MAX_CONCURRENT_SENDS = max(1, int(os.getenv("MAX_CONCURRENT_SENDS", "8")))  # 0 would never acquire a send slot
+MAX_OPEN_BATCHES = max(1, int(os.getenv("MAX_OPEN_BATCHES", "32")))     # per-partition-key batches filled at once
 
 # Create a single, long-lived producer client (Functions worker process reuses this across invocations)
 _producer: Optional[EventHubProducerClient] = None
+# The producer doesn't close its credential, and both must be closed on the loop that opened them
+_credential: Optional[DefaultAzureCredential] = None
+_producer_loop: Optional[asyncio.AbstractEventLoop] = None
 
 def _get_producer() -> EventHubProducerClient:
-    """Gets or creates a long-lived Event Hub producer client."""
-    global _producer
+    """
+    Gets or creates a long-lived Event Hub producer client.
+    Must be called from the worker's event loop, which the client is bound to.
+    """
+    global _producer, _credential, _producer_loop
     if _producer is None:
         if not EVENTHUB_FQDN or not EVENTHUB_NAME:
             raise ValueError("EVENTHUB_FQDN and EVENTHUB_NAME environment variables must be set")
         try:
-            cred = DefaultAzureCredential()
+            _credential = DefaultAzureCredential()
             _producer = EventHubProducerClient(
                 fully_qualified_namespace=EVENTHUB_FQDN,
                 eventhub_name=EVENTHUB_NAME,
-                credential=cred
+                credential=_credential
             )
+            _producer_loop = asyncio.get_running_loop()
             logging.info("Created new Event Hub producer client")
         except Exception as e:
             logging.error("Failed to create Event Hub producer client: %s", e)
             raise
     return _producer
 
+async def _close_producer() -> None:
+    """Close the producer client and then its credential"""
+    try:
+        await _producer.close()
+    finally:
+        await _credential.close()
+
 def _cleanup_producer() -> None:
-    """Cleanup producer on function app shutdown"""
-    global _producer
+    """
+    Cleanup producer and credential on function app shutdown.
+    Best-effort: the async clients can only be closed on the event loop that
+    opened them, which is possible only if the worker's loop is still open and
+    no longer running when atexit handlers run. Otherwise the process exit
+    tears the connections down.
+    """
+    global _producer, _credential, _producer_loop
     if _producer:
+        loop = _producer_loop
         try:
-            _producer.close()
-            logging.info("Event Hub producer client closed")
+            if loop is None or loop.is_closed() or loop.is_running():
+                logging.info("Worker event loop unavailable; leaving Event Hub producer to process exit")
+            else:
+                loop.run_until_complete(_close_producer())
+                logging.info("Event Hub producer client closed")
         except Exception as e:
             logging.warning("Error closing producer client: %s", e)
         _producer = None
+        _credential = None
+        _producer_loop = None
 
 # Register cleanup handler
 atexit.register(_cleanup_producer)
 
-def _is_gzip(name: str, first_bytes: bytes) -> bool:
-    """Check if the blob is gzipped based on filename or magic bytes"""
-    if name.endswith(".gz"):
-        return True
-    return len(first_bytes) >= 2 and first_bytes[0] == 0x1F and first_bytes[1] == 0x8B
+_GUNZIP_CHUNK = 1 << 18
 
-def _read_blob_bytes(input_blob: bytes, name: str) -> bytes:
-    """Read blob bytes, decompressing if gzipped"""
-    head = input_blob[:2] if input_blob else b""
-    if _is_gzip(name, head):
+def _gunzip(data: bytes) -> bytearray:
+    """
+    Decompress a gzip payload into a single buffer presized from the ISIZE
+    trailer, so peak memory stays close to the decompressed size. Input is fed
+    and output drained in chunks, instead of building the whole output as a
+    separate bytes object. zlib checks each member's CRC and ISIZE at its end.
+    Multi-member files are decompressed member by member into the same buffer,
+    and trailing zero padding is ignored as gzip does.
+    """
+    # ISIZE is the last member's size mod 2**32. Deflate can't expand more than
+    # ~1032:1, so a larger value is a corrupt trailer rather than a size hint.
+    size = int.from_bytes(data[-4:], "little")
+    out = bytearray(size if size <= len(data) * 1032 else 0)
+    pos = 0
+    view = memoryview(data)
+    while view:
+        d = zlib.decompressobj(wbits=31)
+        while not d.eof:
+            if not view:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            chunk = d.decompress(view[:_GUNZIP_CHUNK], _GUNZIP_CHUNK)
+            view = view[_GUNZIP_CHUNK:]
+            while True:
+                # Slice assignment grows the buffer if ISIZE undercounted (multi-member)
+                out[pos:pos + len(chunk)] = chunk
+                pos += len(chunk)
+                if not d.unconsumed_tail:
+                    break
+                chunk = d.decompress(d.unconsumed_tail, _GUNZIP_CHUNK)
+        # Input left after a member's trailer is the next member or zero padding
+        view = memoryview((d.unused_data + view).lstrip(b"\x00"))
+    del out[pos:]
+    return out
+
+def _read_blob_bytes(input_blob: bytes, name: str) -> Union[bytes, bytearray]:
+    """Read blob bytes, decompressing if gzipped (detected by the gzip magic bytes)"""
+    if input_blob[:2] == b"\x1f\x8b":
         try:
-            with gzip.GzipFile(fileobj=io.BytesIO(input_blob), mode="rb") as f:
-                return f.read()
+            return _gunzip(input_blob)
         except Exception as e:
             logging.error("Failed to decompress gzipped blob %s: %s", name, e)
             raise
     return input_blob
 
+@functools.lru_cache(maxsize=4096)
+def _ts_to_iso(ts: int) -> str:
+    """
+    Format an integer Unix timestamp the way datetime.isoformat() does for UTC,
+    without building a datetime. Tuples in a blob share a handful of distinct
+    seconds, so most calls are cache hits.
+    """
+    tm = time.gmtime(ts)
+    if not 1 <= tm.tm_year <= 9999:
+        # Keep datetime's supported range
+        raise ValueError("year %d is out of range" % tm.tm_year)
+    return "%04d-%02d-%02dT%02d:%02d:%02d+00:00" % tm[:6]
+
 def _to_iso8601(ts: Union[int, float, str]) -> Optional[str]:
     """
     Convert timestamp to ISO8601 format.
     Handles integer/float Unix timestamps and string timestamps.
     """
-    if isinstance(ts, (int, float)):
+    if isinstance(ts, int):
+        try:
+            return _ts_to_iso(ts)
+        except (ValueError, OSError) as e:
+            logging.warning("Invalid Unix timestamp %s: %s", ts, e)
+            return None
+    if isinstance(ts, float):
         try:
             # Using datetime.fromtimestamp with timezone for modern approach
             return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
@@ -86,56 +189,177 @@ def _to_iso8601(ts: Union[int, float, str]) -> Optional[str]:
         return ts
     return None
 
-def _parse_flow_tuples(flow_tuples: List[str], common: Dict[str, Any]) -> List[Dict[str, Any]]:
+@functools.lru_cache(maxsize=4096)
+def _ts_json(ts: bytes) -> bytes:
+    """
+    JSON value for the raw timestamp field of a fast-path tuple.
+    Cached by the raw bytes, so a repeated timestamp costs one hash lookup
+    instead of an isdigit() scan, an int() parse and a re-encode.
+    """
+    if ts.isdigit():
+        iso = _to_iso8601(int(ts))
+        return b"null" if iso is None else b'"%s"' % iso.encode("ascii")
+    return b'"%s"' % ts
+
+# Flow tuple field lookups, shared across invocations
+_PROTOCOL_MAP = {"T": "TCP", "U": "UDP", "I": "ICMP"}
+_DIRECTION_MAP = {"I": "Inbound", "O": "Outbound", "U": "Unknown"}
+_DECISION_MAP = {"A": "Allow", "D": "Deny"}
+
+def _byte_table(mapping: Dict[str, str]) -> List[bytes]:
+    """
+    Build a 256-entry lookup for single-byte tuple fields.
+    Indexing by the byte value replaces a dict probe; unmapped bytes map to
+    themselves, matching mapping.get(value, value).
+    """
+    table = [bytes((i,)) for i in range(256)]
+    for code, name in mapping.items():
+        table[ord(code)] = name.encode("ascii")
+    return table
+
+_PROTOCOL_TABLE = _byte_table(_PROTOCOL_MAP)
+_DIRECTION_TABLE = _byte_table(_DIRECTION_MAP)
+_DECISION_TABLE = _byte_table(_DECISION_MAP)
+
+@functools.lru_cache(maxsize=1024)
+def _codes_json(protocol: bytes, direction: bytes, decision: bytes) -> bytes:
+    """
+    Pre-encoded JSON members for a fast-path tuple's protocol/direction/decision.
+    A blob only holds a few distinct combinations, so each tuple reuses a cached
+    fragment instead of mapping and formatting the three codes itself.
     """
-    Parse flow tuples from NSG flow logs.
+    return b'"protocol":"%s","direction":"%s","decision":"%s"' % (
+        _PROTOCOL_TABLE[protocol[0]] if len(protocol) == 1 else protocol,
+        _DIRECTION_TABLE[direction[0]] if len(direction) == 1 else direction,
+        _DECISION_TABLE[decision[0]] if len(decision) == 1 else decision,
+    )
+
+# ts, srcIp, destIp, srcPort, destPort, protocol, direction, decision
+_TUPLE_FIELDS = operator.itemgetter(0, 1, 2, 3, 4, 5, 6, 7)
+
+# Fast-path JSON body for a tuple, appended to the serialized common fields
+_RECORD_FORMAT = b'%s,"time":%s,"srcIp":"%s","destIp":"%s","srcPort":"%s","destPort":"%s",%s%s}'
+
+def _parse_flow_tuples(flow_tuples: List[str], common: Dict[str, Any]) -> List[bytes]:
+    """
+    Parse flow tuples from NSG flow logs into serialized JSON event bodies.
     flow_tuples are comma-separated strings.
     """
     results = []
-    protocol_map = {"T": "TCP", "U": "UDP", "I": "ICMP"}
-    direction_map = {"I": "Inbound", "O": "Outbound", "U": "Unknown"}
-    decision_map = {"A": "Allow", "D": "Deny"}
+    try:
+        # Serialize the shared fields once and drop the closing brace
+        prefix = _json_dumps(common)[:-1]
+    except Exception as e:
+        logging.warning("Failed to serialize record to JSON: %s", e)
+        return results
+    # Every record has the same keys in the same order; copying a pre-shaped
+    # dict is much cheaper than rebuilding it with {**common, ...} per tuple.
+    template = dict(common, time=None, srcIp=None, destIp=None, srcPort=None,
+                    destPort=None, protocol=None, direction=None, decision=None)
     
     for t in flow_tuples:
-        parts = [p.strip() for p in t.split(",")]
+        # Well-formed tuples are ASCII with no whitespace and nothing JSON would
+        # escape, so they are split as bytes and their fields formatted straight
+        # into the body. Anything else is stripped and goes through the
+        # serializer; non-ASCII must too, since str.isdigit() accepts Unicode
+        # digits that bytes.isdigit() does not.
+        # (isprintable() is False for control characters and every whitespace
+        # character except " ")
+        plain = t.isascii() and t.isprintable() and " " not in t and '"' not in t and "\\" not in t
+        if plain:
+            parts = t.encode("utf-8").split(b",")
+        else:
+            parts = [p.strip() for p in t.split(",")]
         # Minimum expected parts for v2/v3 is 8
         if len(parts) < 8:
             logging.warning("Skipping malformed flow tuple with %d parts: '%s'", len(parts), t)
             continue
 
+        ts, src_ip, dest_ip, src_port, dest_port, protocol, direction, decision = _TUPLE_FIELDS(parts)
+        # The fields are plain str/bytes after the length check; only the
+        # timestamp conversion can fail (e.g. non-ASCII digits, time_t overflow)
         try:
-            record = {
-                **common,
-                "time": _to_iso8601(int(parts[0])) if parts[0].isdigit() else _to_iso8601(parts[0]),
-                "srcIp": parts[1],
-                "destIp": parts[2],
-                "srcPort": parts[3],
-                "destPort": parts[4],
-                "protocol": protocol_map.get(parts[5], parts[5]),
-                "direction": direction_map.get(parts[6], parts[6]),
-                "decision": decision_map.get(parts[7], parts[7]),
-            }
-            if len(parts) > 8:
-                # Add any extra fields found in the tuple as a list
-                record["extraFields"] = parts[8:]
-            results.append(record)
-        except Exception as e:
+            if plain:
+                time_value = _ts_json(ts)
+            else:
+                time_value = _to_iso8601(int(ts)) if ts.isdigit() else ts
+        except (ValueError, OverflowError) as e:
             logging.warning("Error parsing flow tuple '%s': %s. Record will be skipped.", t, e)
             continue
+
+        if plain:
+            # Add any extra fields found in the tuple as a list
+            extra = b',"extraFields":["%s"]' % b'","'.join(parts[8:]) if len(parts) > 8 else b""
+            results.append(_RECORD_FORMAT % (
+                prefix,
+                time_value,
+                src_ip, dest_ip, src_port, dest_port,
+                _codes_json(protocol, direction, decision),
+                extra,
+            ))
+            continue
+
+        record = template.copy()
+        record["time"] = time_value
+        record["srcIp"] = src_ip
+        record["destIp"] = dest_ip
+        record["srcPort"] = src_port
+        record["destPort"] = dest_port
+        record["protocol"] = _PROTOCOL_MAP.get(protocol, protocol)
+        record["direction"] = _DIRECTION_MAP.get(direction, direction)
+        record["decision"] = _DECISION_MAP.get(decision, decision)
+        if len(parts) > 8:
+            # Add any extra fields found in the tuple as a list
+            record["extraFields"] = parts[8:]
+        try:
+            results.append(_json_dumps(record))
+        except Exception as e:
+            logging.warning("Failed to serialize record to JSON: %s", e)
+            continue
             
     return results
 
-def _flatten_records(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+# (partition key, serialized event bodies) for the tuples of one flow
+_EventGroup = Tuple[Optional[str], List[bytes]]
+
+def _process_rule_block(rule_block: Dict[str, Any], version: Any, resource_id: Optional[str],
+                        category: Optional[str], rec_time: Optional[str]) -> List[_EventGroup]:
     """
-    Parse NSG flow log records from JSON document.
-    Handles both v2 and v3-like shapes.
+    Serialize every flow tuple under one rule block, grouped per NIC.
+    Rule blocks share no state, so each is a self-contained unit of work.
     """
     out = []
+    rule_name = rule_block.get("rule") or rule_block.get("ruleName")
+    inner_flows = rule_block.get("flows", [])
+
+    for f in inner_flows:
+        mac = f.get("mac")
+        flow_tuples = f.get("flowTuples", [])
+        common = {
+            "flowVersion": version,
+            "resourceId": resource_id,
+            "category": category,
+            "rule": rule_name,
+            "mac": mac,
+            "recordTime": rec_time
+        }
+        bodies = _parse_flow_tuples(flow_tuples, common)
+        if bodies:
+            out.append((mac or resource_id, bodies))
+
+    return out
+
+def _flatten_records(doc: Dict[str, Any]) -> Iterator[_EventGroup]:
+    """
+    Parse NSG flow log records from JSON document, yielding serialized records
+    grouped by partition key (the NIC's mac, or the resourceId if there is none).
+    Handles both v2 and v3-like shapes.
+    """
     records = doc.get("records", [])
     
     if not records:
         logging.warning("No 'records' array found in document")
-        return out
+        return
     
     for rec in records:
         props = rec.get("properties", {})
@@ -146,21 +370,7 @@ def _flatten_records(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
 
         flows_root = props.get("flows", [])
         for rule_block in flows_root:
-            rule_name = rule_block.get("rule") or rule_block.get("ruleName")
-            inner_flows = rule_block.get("flows", [])
-
-            for f in inner_flows:
-                mac = f.get("mac")
-                flow_tuples = f.get("flowTuples", [])
-                common = {
-                    "flowVersion": version,
-                    "resourceId": resource_id,
-                    "category": category,
-                    "rule": rule_name,
-                    "mac": mac,
-                    "recordTime": rec_time
-                }
-                out.extend(_parse_flow_tuples(flow_tuples, common))
+            yield from _process_rule_block(rule_block, version, resource_id, category, rec_time)
 
         # Fallback for some v3 shapes where flowTuples are directly in properties
         if not flows_root and "flowTuples" in props:
@@ -170,92 +380,141 @@ def _flatten_records(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
                 "category": category,
                 "recordTime": rec_time
             }
-            out.extend(_parse_flow_tuples(props.get("flowTuples", []), common))
+            bodies = _parse_flow_tuples(props.get("flowTuples", []), common)
+            if bodies:
+                yield resource_id, bodies
 
-    return out
+def _parse_document(raw: Union[bytes, bytearray]) -> Any:
+    """
+    Parse the blob JSON document.
+    With simdjson the result is a lazy, read-only proxy supporting the dict/list
+    accessors used by _flatten_records. A parser is created per blob since the
+    proxies are only valid until their parser parses another document.
+    """
+    if simdjson is not None:
+        return simdjson.Parser().parse(raw)
+    return _json_loads(raw)
 
-def _iter_events_from_blob(blob_bytes: bytes, blob_name: str) -> List[EventData]:
-    """Parse blob content and convert to Event Hub events"""
+def _event_groups_from_blob(blob_bytes: bytes, blob_name: str) -> List[_EventGroup]:
+    """
+    Parse blob content into serialized JSON event bodies, one per flow record,
+    grouped by partition key. The whole blob is flattened before anything is
+    sent, so a malformed document fails before any event reaches Event Hub.
+    """
     try:
-        text = _read_blob_bytes(blob_bytes, blob_name).decode("utf-8")
-        if not text.strip():
+        raw = _read_blob_bytes(blob_bytes, blob_name)
+        # isspace() stops at the first non-whitespace byte; strip() would copy the whole blob
+        if not raw or raw.isspace():
             logging.warning("Blob %s is empty after decompression", blob_name)
             return []
             
-        doc = json.loads(text)
-    except json.JSONDecodeError as e:
+        doc = _parse_document(raw)
+    except ValueError as e:
+        # Covers json/orjson JSONDecodeError and simdjson parse/UTF-8 errors
         logging.error("Failed to parse blob %s as JSON: %s", blob_name, e)
         return []
     except Exception as e:
         logging.error("Failed to process blob %s: %s", blob_name, e, exc_info=True)
         return []
 
-    records = _flatten_records(doc)
-    events = []
-    
-    for r in records:
+    return list(_flatten_records(doc))
+
+async def _send_in_batches(producer: EventHubProducerClient, groups: List[_EventGroup]) -> int:
+    """
+    Send event bodies to Event Hub in batches.
+    One batch is kept open per partition key, so each NIC's flows stay in order
+    on a single partition while different NICs spread across partitions. At most
+    MAX_OPEN_BATCHES are open at once; beyond that the oldest is sent early.
+    Batches are filled while up to MAX_CONCURRENT_SENDS earlier batches are still
+    being sent. The first failed send stops further batches from being queued;
+    sends already in flight are left to finish before the error is re-raised.
+    """
+    slots = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+    sends: List[asyncio.Task] = []
+    batches: Dict[Optional[str], EventDataBatch] = {}
+
+    async def _send(batch: EventDataBatch) -> int:
         try:
-            event_data = json.dumps(r, ensure_ascii=False)
-            events.append(EventData(event_data))
-        except Exception as e:
-            logging.warning("Failed to serialize record to JSON: %s", e)
-            continue
-            
-    return events
+            await producer.send_batch(batch)
+            logging.debug("Sent batch of %d events", len(batch))
+            return len(batch)
+        finally:
+            slots.release()
+
+    def _first_error() -> Optional[BaseException]:
+        # exception() is read on every finished task so none is reported as unretrieved
+        errors = [task.exception() for task in sends if task.done()]
+        return next((e for e in errors if e is not None), None)
+
+    async def _dispatch(batch: EventDataBatch) -> None:
+        await slots.acquire()
+        # Stop queuing batches once an earlier send has failed
+        error = _first_error()
+        if error is not None:
+            slots.release()
+            raise error
+        sends.append(asyncio.create_task(_send(batch)))
+        # Let the send start before we go back to filling the next batch
+        await asyncio.sleep(0)
 
-def _send_in_batches(producer: EventHubProducerClient, events: List[EventData]) -> int:
-    """Send events to Event Hub in batches"""
-    if not events:
-        logging.info("No events to send")
-        return 0
-    
-    sent = 0
     try:
-        batch = producer.create_batch()
-        
-        for ev in events:
-            try:
-                batch.add(ev)
-            except ValueError:
-                # Batch is full, send it
-                if len(batch) > 0:
-                    producer.send_batch(batch)
-                    sent += len(batch)
-                    logging.debug("Sent batch of %d events", len(batch))
-                
-                # Create new batch and try to add the event
-                batch = producer.create_batch()
+        for partition_key, bodies in groups:
+            batch = batches.get(partition_key)
+            if batch is None:
+                if len(batches) >= MAX_OPEN_BATCHES:
+                    # Flush the longest-open key's batch; its later events go in a new batch
+                    oldest = batches.pop(next(iter(batches)))
+                    if len(oldest) > 0:
+                        await _dispatch(oldest)
+                batch = batches[partition_key] = await producer.create_batch(partition_key=partition_key)
+
+            for body in bodies:
+                # Bytes bodies go straight into EventData, no re-encode needed
+                ev = EventData(body)
                 try:
                     batch.add(ev)
                 except ValueError:
-                    # This event is too large to fit in a batch, even alone.
+                    # Batch is full, send it
+                    if len(batch) > 0:
+                        await _dispatch(batch)
+                    
+                    # Create new batch and try to add the event
+                    batch = batches[partition_key] = await producer.create_batch(partition_key=partition_key)
                     try:
-                        size = len(ev.body_as_bytes())
-                        logging.error("Event too large to fit in a batch (size: %d bytes), skipping.", size)
-                    except Exception:
-                        logging.error("Event too large to fit in a batch, skipping.")
-                    continue
-            
-            # Send batch if it reaches max size
-            if len(batch) >= MAX_EVENTS_PER_BATCH:
-                producer.send_batch(batch)
-                sent += len(batch)
-                logging.debug("Sent batch of %d events", len(batch))
-                batch = producer.create_batch()
+                        batch.add(ev)
+                    except ValueError:
+                        # This event is too large to fit in a batch, even alone.
+                        logging.error("Event too large to fit in a batch (size: %d bytes), skipping.", len(body))
+                        continue
+                
+                # Send batch if it reaches max size
+                if len(batch) >= MAX_EVENTS_PER_BATCH:
+                    await _dispatch(batch)
+                    batch = batches[partition_key] = await producer.create_batch(partition_key=partition_key)
         
-        # Send remaining events in batch
-        if len(batch) > 0:
-            producer.send_batch(batch)
-            sent += len(batch)
-            logging.debug("Sent final batch of %d events", len(batch))
+        # Send remaining events in each partition key's batch
+        for batch in batches.values():
+            if len(batch) > 0:
+                await _dispatch(batch)
+
+        if sends:
+            await asyncio.wait(sends)
+        error = _first_error()
+        if error is not None:
+            raise error
+        sent = sum(task.result() for task in sends)
             
     except Exception as e:
+        # Let in-flight sends settle rather than cancelling them mid-delivery
+        if sends:
+            await asyncio.wait(sends)
+            _first_error()
         logging.error("Failed to send events to Event Hub: %s", e, exc_info=True)
         raise
     
     return sent
 
-def main(inputBlob: func.InputStream) -> None:
+async def main(inputBlob: func.InputStream) -> None:
     """Main Azure Function entry point"""
     blob_name = inputBlob.name
     blob_len = inputBlob.length
@@ -268,17 +527,19 @@ def main(inputBlob: func.InputStream) -> None:
             logging.warning("Blob %s is empty", blob_name)
             return
 
-        # Parse events from blob
-        events = _iter_events_from_blob(data, blob_name)
-        logging.info("Parsed %d flow records from %s", len(events), blob_name)
+        # Parse events from blob; gunzip, parsing and serialization are CPU-bound,
+        # so they run in a worker thread to keep the event loop free for sends
+        groups = await asyncio.to_thread(_event_groups_from_blob, data, blob_name)
+        logging.info("Parsed %d flow records from %s",
+                    sum(len(bodies) for _, bodies in groups), blob_name)
 
-        if not events:
+        if not groups:
             logging.info("No events to send from blob %s", blob_name)
             return
 
         # Send events to Event Hub
         producer = _get_producer()
-        sent = _send_in_batches(producer, events)
+        sent = await _send_in_batches(producer, groups)
         logging.info("Successfully sent %d events to Event Hub '%s' from blob %s", 
                     sent, EVENTHUB_NAME, blob_name)
         
@@ -0,0 +1 @@
+# Lets the tests import the FlowLogToEventHub function package from the repo root
@@ -0,0 +1,112 @@
+"""
+Check the bytes fast path in _parse_flow_tuples against the record dict the
+function used to build, serialized with _json_dumps.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+import FlowLogToEventHub as fn
+
+_PROTOCOL_MAP = {"T": "TCP", "U": "UDP", "I": "ICMP"}
+_DIRECTION_MAP = {"I": "Inbound", "O": "Outbound", "U": "Unknown"}
+_DECISION_MAP = {"A": "Allow", "D": "Deny"}
+
+COMMON = {
+    "flowVersion": 2,
+    "resourceId": "/SUBSCRIPTIONS/0000/RESOURCEGROUPS/RG/PROVIDERS/MICROSOFT.NETWORK/NETWORKSECURITYGROUPS/NSG",
+    "category": "NetworkSecurityGroupFlowEvent",
+    "rule": "DefaultRule_AllowInternetOutBound",
+    "mac": "000D3AF87856",
+    "recordTime": "2024-05-01T10:00:00.0000000Z",
+}
+
+def _to_iso8601(ts):
+    if isinstance(ts, int):
+        try:
+            return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+        except (ValueError, OSError):
+            return None
+    return ts
+
+def _expected_bodies(t, common):
+    """Serialized record for one tuple, built the way the dict-based parser did"""
+    parts = [p.strip() for p in t.split(",")]
+    if len(parts) < 8:
+        return []
+    try:
+        record = {
+            **common,
+            "time": _to_iso8601(int(parts[0])) if parts[0].isdigit() else _to_iso8601(parts[0]),
+            "srcIp": parts[1],
+            "destIp": parts[2],
+            "srcPort": parts[3],
+            "destPort": parts[4],
+            "protocol": _PROTOCOL_MAP.get(parts[5], parts[5]),
+            "direction": _DIRECTION_MAP.get(parts[6], parts[6]),
+            "decision": _DECISION_MAP.get(parts[7], parts[7]),
+        }
+    except Exception:
+        # e.g. OverflowError from fromtimestamp: the record is skipped
+        return []
+    if len(parts) > 8:
+        record["extraFields"] = parts[8:]
+    return [fn._json_dumps(record)]
+
+TUPLES = [
+    # Well-formed v1/v2 tuples
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,U,I,D",
+    "1714557600,10.0.0.4,52.239.1.2,,,I,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A,B,,,,",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A,E,12,3456,9,1234",
+    # Trailing empty extra field
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A,",
+    # Unmapped and multi-character codes
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,X,Y,Z",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,TCP,Out,Allow",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,,,",
+    # Non-numeric timestamps are passed through as strings
+    "2024-05-01T10:00:00Z,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "-1,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "1714557600.5,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    ",10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    # Epoch, out-of-range year and overflowing timestamps
+    "0,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "253402300799,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "253402300800,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "99999999999999999999,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "0001714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    # Characters JSON must escape
+    '1714557600,10.0.0."4,52.239.1.2,44931,443,T,O,A',
+    "1714557600,10.0.0.4\\,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A,\"x\\y\"",
+    # Whitespace around and inside fields
+    " 1714557600 , 10.0.0.4 ,52.239.1.2,44931,443, T ,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A\n",
+    "\t1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0 .0.4,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A, ",
+    # Control characters
+    "1714557600,10.0.0.4\x01,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A\x7f",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,\x00",
+    # Non-ASCII digits and text
+    "١٧١٤٥٥٧٦٠٠,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "１７１４,10.0.0.4,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,٤٤٩٣١,443,T,O,A",
+    "1714557600,10.0.0.é,52.239.1.2,44931,443,T,O,A",
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O,A,\U0001f600",
+    # Malformed tuples are skipped
+    "1714557600,10.0.0.4,52.239.1.2,44931,443,T,O",
+    "",
+]
+
+@pytest.mark.parametrize("t", TUPLES)
+def test_body_matches_serialized_record(t):
+    assert fn._parse_flow_tuples([t], COMMON) == _expected_bodies(t, COMMON)
+
+def test_body_matches_serialized_record_without_mac():
+    common = {"flowVersion": "v3", "resourceId": None, "category": "cé", "recordTime": None}
+    expected = [body for t in TUPLES for body in _expected_bodies(t, common)]
+    assert fn._parse_flow_tuples(TUPLES, common) == expected